@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from catalog.models import ProductCardModel
+
+
+
+class Command(BaseCommand):
+    """ Перерисовка описаний всех карточек товаров после изменения правил """
+
+    help = "Пересобирает очищенный HTML и текст описаний карточек товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Размер пачки для сохранения")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным числом")
+        cards_qs = ProductCardModel.objects.only('id', 'description', 'description_html', 'description_text')
+
+        batch, updated = [], 0
+        for card in cards_qs.iterator(chunk_size=batch_size):
+            old = (card.description_html, card.description_text)
+            card.render_description()
+            if (card.description_html, card.description_text) == old:
+                continue
+
+            batch.append(card)
+            if len(batch) >= batch_size:
+                updated += self.flush(batch)
+
+        updated += self.flush(batch)
+        self.stdout.write(self.style.SUCCESS(f'Обновлено описаний: {updated}'))
+
+    def flush(self, batch):
+        # bulk_update не трогает latest_update, карточки не считаются изменёнными
+        ProductCardModel.objects.bulk_update(batch, ['description_html', 'description_text'])
+        count = len(batch)
+        batch.clear()
+        return count
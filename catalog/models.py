@@ -5,6 +5,7 @@ from main.models import AbstractStatusModel
 from django_resized import ResizedImageField
 from mptt.models import MPTTModel, TreeForeignKey
 from django_ckeditor_5.fields import CKEditor5Field
+from catalog.render import render_description
 
 
 
@@ -159,6 +160,8 @@ class ProductCardModel(AbstractStatusModel):
     price = models.PositiveIntegerField(verbose_name="Стоимость", null=True, blank=True)
     category = models.ForeignKey(CategoryModel, verbose_name="Категория", on_delete=models.SET_NULL, null=True, blank=True)
     description = CKEditor5Field(verbose_name="Описание", null=True, blank=True)
+    description_html = models.TextField(verbose_name="Описание (HTML)", default='', blank=True, editable=False)
+    description_text = models.TextField(verbose_name="Описание (текст)", default='', blank=True, editable=False)
     preview = ResizedImageField(
         size = [235, 177], verbose_name="", crop = ['middle', 'center'],       
         help_text="Миниатира товара (235x177 px)",
@@ -173,6 +176,19 @@ class ProductCardModel(AbstractStatusModel):
 
     def __str__(self):
         return self.name
+
+    def render_description(self):
+        """ Очищенный HTML и текст описания готовятся при сохранении, а не при выдаче """
+        self.description_html, self.description_text = render_description(self.description)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.render_description()
+        elif 'description' in update_fields:
+            self.render_description()
+            kwargs['update_fields'] = {*update_fields, 'description_html', 'description_text'}
+        super(ProductCardModel, self).save(*args, **kwargs)
     
 
 class ProductImagesModel(models.Model):
@@ -0,0 +1,233 @@
+""" Подготовка описаний карточек товаров при сохранении """
+
+import os
+import re
+import tempfile
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, quote, unquote
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.http.request import validate_host
+
+
+
+# Разрешённые теги и атрибуты (соответствуют панели CKEditor 5 из settings)
+ALLOWED_TAGS = {
+    'p', 'br', 'h2', 'h3', 'h4', 'strong', 'b', 'em', 'i', 'a',
+    'ul', 'ol', 'li', 'blockquote', 'figure', 'figcaption', 'img',
+}
+ALLOWED_ATTRS = {
+    'a': ('href', 'title'),
+    'img': ('src', 'alt'),
+    'figure': ('class', 'style'),
+}
+VOID_TAGS = {'br', 'img'}
+# Теги, содержимое которых выбрасывается целиком
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template', 'noscript'}
+# Блочные теги, разделяющие текст в текстовой выжимке
+BLOCK_TAGS = {'p', 'br', 'h2', 'h3', 'h4', 'li', 'blockquote', 'figcaption'}
+ALLOWED_SCHEMES = {'', 'http', 'https', 'mailto', 'tel'}
+# Классы, которые CKEditor 5 ставит на <figure> (остальные отбрасываются)
+ALLOWED_FIGURE_CLASSES = {'image', 'image_resized'}
+ALLOWED_FIGURE_CLASS_PREFIX = 'image-style-'
+# Ширина, которую CKEditor 5 ставит на <figure class="image_resized">
+FIGURE_WIDTH_RE = re.compile(r'^\s*width\s*:\s*(\d{1,3}(?:\.\d+)?)%\s*;?\s*$')
+
+# Максимальная ширина изображения в описании, px
+DESCRIPTION_IMAGE_WIDTH = 640
+
+
+
+def is_safe_url(url):
+    """ Допускаются только относительные и http(s)/mailto/tel ссылки """
+    # Браузеры игнорируют пробелы и управляющие символы, например "java\tscript:"
+    url = ''.join(char for char in url if char > ' ' and char != '\x7f')
+    scheme, sep, _ = url.partition(':')
+    if not sep or any(char in scheme for char in '/?#'):
+        return True
+    return scheme.lower() in ALLOWED_SCHEMES
+
+
+def is_external_url(url):
+    """ Абсолютная ссылка на чужой хост (свои хосты берутся из ALLOWED_HOSTS) """
+    parts = urlsplit(url.strip())
+    if not parts.netloc:
+        return False
+    allowed_hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+    return not validate_host(parts.hostname or '', allowed_hosts)
+
+
+def figure_classes(value):
+    """ Оставляет в class у <figure> только классы CKEditor """
+    return ' '.join(
+        name for name in value.split()
+        if name in ALLOWED_FIGURE_CLASSES or name.startswith(ALLOWED_FIGURE_CLASS_PREFIX)
+    )
+
+
+def figure_width(style):
+    """ Оставляет из style у <figure> только width в процентах, иначе None """
+    match = FIGURE_WIDTH_RE.match(style)
+    if match is None or float(match.group(1)) > 100:
+        return None
+    return f'width:{match.group(1)}%'
+
+
+def media_path(url):
+    """ Путь к файлу в MEDIA_ROOT для локальной ссылки вида /files/..., иначе None """
+    parts = urlsplit(url.strip())
+    # Ссылки на другие хосты не трогаем, даже если путь совпадает
+    if parts.scheme or parts.netloc:
+        return None
+    path = unquote(parts.path)
+    if not path.startswith(settings.MEDIA_URL):
+        return None
+    name = os.path.normpath(path[len(settings.MEDIA_URL):])
+    if name.startswith('..') or os.path.isabs(name):
+        return None
+    return name
+
+
+def save_derivative(img, target, size):
+    """ Пишет уменьшенную копию во временный файл и атомарно подменяет target """
+    fd, tmp_target = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            img.convert('RGBA' if 'A' in img.getbands() else 'RGB').resize(
+                size, Image.LANCZOS,
+            ).save(file, 'WEBP', quality=90)
+        # mkstemp создаёт файл с правами 0600, веб-сервер должен его читать
+        os.chmod(tmp_target, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.replace(tmp_target, target)
+    except BaseException:
+        os.unlink(tmp_target)
+        raise
+
+
+def image_derivative(url):
+    """
+        Возвращает (url, width, height) для изображения из описания.
+        Широкие изображения уменьшаются до DESCRIPTION_IMAGE_WIDTH и
+        сохраняются в WEBP рядом с оригиналом, пока оригинал не изменится.
+    """
+    name = media_path(url)
+    if name is None:
+        return url, None, None
+
+    source = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        with Image.open(source) as img:
+            # Фото с телефонов хранят поворот в EXIF, браузер показывает их повёрнутыми
+            img = ImageOps.exif_transpose(img)
+            width, height = img.size
+            if width <= DESCRIPTION_IMAGE_WIDTH:
+                return url, width, height
+
+            new_height = round(height * DESCRIPTION_IMAGE_WIDTH / width)
+            # Имя оригинала целиком (с расширением), чтобы photo.png и photo.jpg не совпадали
+            derivative = f'{name}.{DESCRIPTION_IMAGE_WIDTH}w.webp'
+            target = os.path.join(settings.MEDIA_ROOT, derivative)
+            # Пересоздаём, если оригинал был заменён после создания производного
+            if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+                save_derivative(img, target, (DESCRIPTION_IMAGE_WIDTH, new_height))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Битый или подозрительный файл не должен мешать сохранению карточки
+        return url, None, None
+
+    return settings.MEDIA_URL + quote(derivative.replace(os.sep, '/')), DESCRIPTION_IMAGE_WIDTH, new_height
+
+
+class DescriptionRenderer(HTMLParser):
+    """ Очищает HTML по белому списку и собирает текстовую выжимку """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth or tag not in ALLOWED_TAGS:
+            return
+
+        allowed = ALLOWED_ATTRS.get(tag, ())
+        attrs = {name: value or '' for name, value in attrs if name in allowed}
+
+        if tag == 'a':
+            if not is_safe_url(attrs.get('href', '')):
+                attrs.pop('href', None)
+            # Свои ссылки (категории, товары) должны индексироваться
+            external = is_external_url(attrs.get('href', ''))
+            attrs['rel'] = 'nofollow noopener' if external else 'noopener'
+        elif tag == 'figure':
+            classes = figure_classes(attrs.pop('class', ''))
+            width = figure_width(attrs.pop('style', ''))
+            if classes:
+                attrs['class'] = classes
+            if width and 'image_resized' in classes.split():
+                attrs['style'] = width
+        elif tag == 'img':
+            src = attrs.get('src', '')
+            if not src or not is_safe_url(src):
+                return
+            attrs['src'], width, height = image_derivative(src)
+            if width and height:
+                attrs['width'], attrs['height'] = width, height
+            attrs['loading'] = 'lazy'
+            attrs['decoding'] = 'async'
+            attrs.setdefault('alt', '')
+
+        rendered = ''.join(f' {name}="{escape(str(value))}"' for name, value in attrs.items())
+        self.html.append(f'<{tag}{rendered}>')
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        if self.skip_depth or tag not in self.open_tags:
+            return
+        # Закрываем все незакрытые вложенные теги
+        while self.open_tags:
+            current = self.open_tags.pop()
+            self.html.append(f'</{current}>')
+            if current == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def result(self):
+        self.close()
+        while self.open_tags:
+            self.html.append(f'</{self.open_tags.pop()}>')
+        lines = (' '.join(line.split()) for line in ''.join(self.text).splitlines())
+        return ''.join(self.html), '\n'.join(line for line in lines if line)
+
+
+def render_description(raw):
+    """ Возвращает (очищенный HTML, текстовую выжимку) для описания товара """
+    if not raw:
+        return '', ''
+    renderer = DescriptionRenderer()
+    renderer.feed(raw)
+    return renderer.result()
@@ -1,3 +1,295 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from PIL import Image
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+
+from catalog.models import ProductCardModel
+from catalog.render import render_description
+
+
+
+class RenderDescriptionTest(TestCase):
+    """ Очистка HTML описаний карточек товаров """
+
+    def test_empty(self):
+        self.assertEqual(render_description(None), ('', ''))
+        self.assertEqual(render_description(''), ('', ''))
+
+    def test_drops_dangerous_tags_with_content(self):
+        html, text = render_description(
+            '<p>До<script>alert(1)</script><style>p{color:red}</style>'
+            '<iframe src="https://evil"><b>внутри</b></iframe>После</p>'
+        )
+        self.assertEqual(html, '<p>ДоПосле</p>')
+        self.assertEqual(text, 'ДоПосле')
+
+    def test_drops_unknown_tags_and_attributes(self):
+        html, _ = render_description('<div onclick="x()"><p style="color:red" onmouseover="y()">Текст</p></div>')
+        self.assertEqual(html, '<p>Текст</p>')
+
+    def test_strips_javascript_href(self):
+        for href in (
+            'javascript:alert(1)',
+            ' JavaScript:alert(1)',
+            '&#106;avascript:alert(1)',
+            '&#x6A;&#x61;vascript:alert(1)',
+            'java&#9;script:alert(1)',
+            'java\tscript:alert(1)',
+            'java\x01script:alert(1)',
+            '\x00javascript:alert(1)',
+            'vbscript:msgbox(1)',
+            'data:text/html,<script>alert(1)</script>',
+        ):
+            with self.subTest(href=href):
+                html, _ = render_description(f'<a href="{href}">ссылка</a>')
+                self.assertEqual(html, '<a rel="noopener">ссылка</a>')
+
+    def test_keeps_safe_href(self):
+        for href in ('https://example.com/?a=1', '/c/1/', 'mailto:shop@example.com', 'tel:+78112000000', '#top'):
+            with self.subTest(href=href):
+                html, _ = render_description(f'<a href="{href}">ссылка</a>')
+                self.assertIn('href=', html)
+
+    @override_settings(ALLOWED_HOSTS=['.glsvar.ru'])
+    def test_nofollow_only_external_links(self):
+        for href, rel in (
+            ('/c/1/', 'noopener'),
+            ('#top', 'noopener'),
+            ('https://glsvar.ru/c/1/', 'noopener'),
+            ('https://shop.glsvar.ru:8080/c/1/', 'noopener'),
+            ('https://example.com/', 'nofollow noopener'),
+            ('//example.com/', 'nofollow noopener'),
+        ):
+            with self.subTest(href=href):
+                html, _ = render_description(f'<a href="{href}">ссылка</a>')
+                self.assertIn(f'rel="{rel}"', html)
+
+    def test_strips_javascript_src(self):
+        for src in ('javascript:alert(1)', '&#106;avascript:alert(1)', 'java\nscript:alert(1)'):
+            with self.subTest(src=src):
+                html, _ = render_description(f'<p><img src="{src}"></p>')
+                self.assertEqual(html, '<p></p>')
+
+    def test_escapes_attributes_and_text(self):
+        html, text = render_description(
+            '<p><a href="/c/?a=1&amp;b=2" title="&quot;&gt;<script>">1 &lt; 2</a></p>'
+        )
+        self.assertEqual(
+            html,
+            '<p><a href="/c/?a=1&amp;b=2" title="&quot;&gt;&lt;script&gt;" rel="noopener">1 &lt; 2</a></p>',
+        )
+        self.assertEqual(text, '1 < 2')
+
+    def test_closes_unclosed_tags(self):
+        html, _ = render_description('<p><b>Один<i>Два</p><p>Три')
+        self.assertEqual(html, '<p><b>Один<i>Два</i></b></p><p>Три</p>')
+        html, _ = render_description('<ul><li><b>Один<li>Два</ul>')
+        self.assertEqual(html, '<ul><li><b>Один<li>Два</li></b></li></ul>')
+
+    def test_ignores_stray_closing_tags(self):
+        html, _ = render_description('</p></b>Текст</i>')
+        self.assertEqual(html, 'Текст')
+
+    def test_figure_classes(self):
+        html, _ = render_description('<figure class="image image-style-side image_resized btn-danger"></figure>')
+        self.assertEqual(html, '<figure class="image image-style-side image_resized"></figure>')
+        html, _ = render_description('<figure class="hidden"></figure>')
+        self.assertEqual(html, '<figure></figure>')
+
+    def test_figure_resized_width(self):
+        html, _ = render_description('<figure class="image image_resized" style="width:52.5%;"></figure>')
+        self.assertEqual(html, '<figure class="image image_resized" style="width:52.5%"></figure>')
+        for classes, style in (
+            ('image image_resized', 'width:50%;background:url(x)'),
+            ('image image_resized', 'width:500px'),
+            ('image image_resized', 'width:500%'),
+            ('image', 'width:50%'),
+        ):
+            with self.subTest(classes=classes, style=style):
+                html, _ = render_description(f'<figure class="{classes}" style="{style}"></figure>')
+                self.assertEqual(html, f'<figure class="{classes}"></figure>')
+
+    def test_plain_text(self):
+        _, text = render_description(
+            '<h2>Сварочный   аппарат</h2><p>Ток до <b>200</b> А</p>'
+            '<ul><li>Инвертор</li><li>MMA</li></ul><p>Строка<br>вторая</p>'
+        )
+        self.assertEqual(text, 'Сварочный аппарат\nТок до 200 А\nИнвертор\nMMA\nСтрока\nвторая')
+
+
+class RenderDescriptionImagesTest(TestCase):
+    """ Размеры и производные изображений в описаниях """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/files/')
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, 'u'))
+
+    def make_image(self, name, size, mode='RGB'):
+        path = os.path.join(self.media_root, name)
+        Image.new(mode, size).save(path)
+        return path
+
+    def test_small_image_gets_dimensions(self):
+        self.make_image('u/small.png', (300, 200))
+        html, _ = render_description('<img src="/files/u/small.png" alt="Фото">')
+        self.assertEqual(
+            html,
+            '<img src="/files/u/small.png" alt="Фото" width="300" height="200" loading="lazy" decoding="async">',
+        )
+
+    def test_wide_image_gets_derivative(self):
+        self.make_image('u/photo.png', (1280, 960))
+        html, _ = render_description('<img src="/files/u/photo.png">')
+        self.assertEqual(
+            html,
+            '<img src="/files/u/photo.png.640w.webp" width="640" height="480" loading="lazy" decoding="async" alt="">',
+        )
+        with Image.open(os.path.join(self.media_root, 'u/photo.png.640w.webp')) as img:
+            self.assertEqual(img.size, (640, 480))
+
+    def test_derivative_leaves_no_temp_files(self):
+        self.make_image('u/photo.png', (1280, 960))
+        render_description('<img src="/files/u/photo.png">')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.media_root, 'u'))), ['photo.png', 'photo.png.640w.webp'])
+
+    def test_derivatives_do_not_collide(self):
+        self.make_image('u/photo.png', (1280, 960))
+        self.make_image('u/photo.jpg', (1600, 400))
+        render_description('<img src="/files/u/photo.png">')
+        html, _ = render_description('<img src="/files/u/photo.jpg">')
+        self.assertIn('src="/files/u/photo.jpg.640w.webp" width="640" height="160"', html)
+
+    def test_derivative_url_is_quoted(self):
+        self.make_image('u/a#b.png', (1280, 960))
+        self.make_image('u/фото 1.png', (1280, 960))
+        html, _ = render_description('<img src="/files/u/a%23b.png">')
+        self.assertIn('src="/files/u/a%23b.png.640w.webp"', html)
+        html, _ = render_description('<img src="/files/u/%D1%84%D0%BE%D1%82%D0%BE%201.png">')
+        self.assertIn('src="/files/u/%D1%84%D0%BE%D1%82%D0%BE%201.png.640w.webp"', html)
+
+    def test_replaced_original_refreshes_derivative(self):
+        source = self.make_image('u/photo.png', (1280, 960))
+        render_description('<img src="/files/u/photo.png">')
+        derivative = os.path.join(self.media_root, 'u/photo.png.640w.webp')
+        os.utime(derivative, (0, 0))
+
+        self.make_image('u/photo.png', (1280, 320))
+        self.assertGreater(os.path.getmtime(source), os.path.getmtime(derivative))
+        html, _ = render_description('<img src="/files/u/photo.png">')
+        self.assertIn('width="640" height="160"', html)
+        with Image.open(derivative) as img:
+            self.assertEqual(img.size, (640, 160))
+
+    def make_rotated_jpeg(self, name, size):
+        # Orientation=6: кадр снят повёрнутым, показывать нужно с поворотом на 90°
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', size).save(os.path.join(self.media_root, name), exif=exif)
+
+    def test_exif_orientation_dimensions(self):
+        self.make_rotated_jpeg('u/phone.jpg', (400, 300))
+        html, _ = render_description('<img src="/files/u/phone.jpg">')
+        self.assertIn('src="/files/u/phone.jpg" width="300" height="400"', html)
+
+    def test_exif_orientation_derivative(self):
+        self.make_rotated_jpeg('u/phone.jpg', (1600, 1200))
+        html, _ = render_description('<img src="/files/u/phone.jpg">')
+        self.assertIn('src="/files/u/phone.jpg.640w.webp" width="640" height="853"', html)
+        with Image.open(os.path.join(self.media_root, 'u/phone.jpg.640w.webp')) as img:
+            self.assertEqual(img.size, (640, 853))
+
+    def test_foreign_host_is_not_local(self):
+        self.make_image('u/photo.png', (1280, 960))
+        html, _ = render_description('<img src="https://example.com/files/u/photo.png">')
+        self.assertEqual(
+            html,
+            '<img src="https://example.com/files/u/photo.png" loading="lazy" decoding="async" alt="">',
+        )
+
+    def test_path_outside_media_root(self):
+        html, _ = render_description('<img src="/files/../settings.py">')
+        self.assertNotIn('width=', html)
+
+    def test_broken_image_fails_soft(self):
+        with open(os.path.join(self.media_root, 'u/broken.png'), 'wb') as file:
+            file.write(b'not an image')
+        html, _ = render_description('<img src="/files/u/broken.png">')
+        self.assertEqual(html, '<img src="/files/u/broken.png" loading="lazy" decoding="async" alt="">')
+
+    def test_decompression_bomb_fails_soft(self):
+        self.make_image('u/bomb.png', (1280, 960), mode='L')
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        html, _ = render_description('<img src="/files/u/bomb.png">')
+        self.assertEqual(html, '<img src="/files/u/bomb.png" loading="lazy" decoding="async" alt="">')
+
+
+class ProductCardDescriptionTest(TestCase):
+    """ Сохранение подготовленного описания в карточке товара """
+
+    def test_save_renders_description(self):
+        card = ProductCardModel.objects.create(name='Аппарат', description='<p>Текст<script>x</script></p>')
+        card.refresh_from_db()
+        self.assertEqual(card.description_html, '<p>Текст</p>')
+        self.assertEqual(card.description_text, 'Текст')
+
+    def test_save_update_fields_with_description(self):
+        card = ProductCardModel.objects.create(name='Аппарат', description='<p>Старый</p>')
+        card.description = '<p>Новый</p>'
+        card.save(update_fields=['description'])
+        card.refresh_from_db()
+        self.assertEqual(card.description_html, '<p>Новый</p>')
+        self.assertEqual(card.description_text, 'Новый')
+
+    def test_save_update_fields_without_description(self):
+        card = ProductCardModel.objects.create(name='Аппарат', description='<p>Старый</p>')
+        card.description = '<p>Новый</p>'
+        card.price = 100
+        card.save(update_fields=['price'])
+        self.assertEqual(card.description_html, '<p>Старый</p>')
+        card.refresh_from_db()
+        self.assertEqual(card.price, 100)
+        self.assertEqual(card.description_html, '<p>Старый</p>')
+
+
+class RenderDescriptionsCommandTest(TestCase):
+    """ Команда render_descriptions """
+
+    def test_updates_only_changed_cards(self):
+        fresh = ProductCardModel.objects.create(name='Свежая', description='<p>Один</p>')
+        stale = ProductCardModel.objects.create(name='Устаревшая', description='<p>Два</p>')
+        ProductCardModel.objects.filter(pk=stale.pk).update(description_html='<p>Два<script></script></p>', description_text='')
+        fresh_update = ProductCardModel.objects.get(pk=fresh.pk).latest_update
+
+        out = StringIO()
+        call_command('render_descriptions', stdout=out)
+
+        self.assertIn('Обновлено описаний: 1', out.getvalue())
+        stale.refresh_from_db()
+        self.assertEqual(stale.description_html, '<p>Два</p>')
+        self.assertEqual(stale.description_text, 'Два')
+        self.assertEqual(ProductCardModel.objects.get(pk=fresh.pk).latest_update, fresh_update)
+
+    def test_small_batches(self):
+        for index in range(5):
+            ProductCardModel.objects.create(name=f'Карточка {index}', description=f'<p>{index}</p>')
+        ProductCardModel.objects.update(description_html='', description_text='')
+
+        out = StringIO()
+        call_command('render_descriptions', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Обновлено описаний: 5', out.getvalue())
+        self.assertFalse(ProductCardModel.objects.filter(description_html='').exists())
+
+    def test_invalid_batch_size(self):
+        for batch_size in ('0', '-1'):
+            with self.subTest(batch_size=batch_size), self.assertRaises(CommandError):
+                call_command('render_descriptions', '--batch-size', batch_size, stdout=StringIO())